@@ -34,6 +34,7 @@ either expressed or implied, of the FreeBSD Project.
 
 #include <math.h>
 #include <assert.h>
+#include <stddef.h>
 #include <stdint.h>
 #include <string.h>
 #include <stdio.h>
@@ -285,9 +286,11 @@ static uint32_t rgb_scale(uint32_t rgb, float a)
     return (r<<16) | (g<<8) | b;
 }
 
+// The quick_decode table lives in fam->impl and belongs to the family
+// (freed by apriltag_family_destroy), so that one family can be shared
+// by several detectors; removing it from a detector leaves it intact.
 void apriltag_detector_remove_family(apriltag_detector_t *td, apriltag_family_t *fam)
 {
-    quick_decode_uninit(fam);
     zarray_remove_value(td->tag_families, &fam, 0);
 }
 
@@ -304,11 +307,6 @@ void apriltag_detector_add_family(apriltag_detector_t *td, apriltag_family_t *fa
 
 void apriltag_detector_clear_families(apriltag_detector_t *td)
 {
-    for (int i = 0; i < zarray_size(td->tag_families); i++) {
-        apriltag_family_t *fam;
-        zarray_get(td->tag_families, i, &fam);
-        quick_decode_uninit(fam);
-    }
     zarray_clear(td->tag_families);
 }
 
@@ -1381,8 +1379,8 @@ zarray_t *apriltag_detector_detect(apriltag_detector_t *td, image_u8_t *im_orig)
     zarray_sort(detections, detection_compare_function);
     timeprofile_stamp(td->tp, "cleanup");
 
-    //free((image_u8_t*)im_orig); //sandeep edit
-    image_u8_destroy(im_orig);
+    // im_orig belongs to the caller, who may have aliased its buffer
+    // onto memory we did not allocate; never free it here.
     //free((image_u8_t*)quad_im); //sandeep's edit, already freed
     //free((zarray_t*)s); // sandeep's edit doesn't work
 
@@ -1402,3 +1400,16 @@ void apriltag_detections_destroy(zarray_t *detections)
 
     zarray_destroy(detections);
 }
+
+void apriltag_detection_layout(int *offsets, int *size)
+{
+    offsets[0] = offsetof(apriltag_detection_t, family);
+    offsets[1] = offsetof(apriltag_detection_t, id);
+    offsets[2] = offsetof(apriltag_detection_t, hamming);
+    offsets[3] = offsetof(apriltag_detection_t, goodness);
+    offsets[4] = offsetof(apriltag_detection_t, decision_margin);
+    offsets[5] = offsetof(apriltag_detection_t, H);
+    offsets[6] = offsetof(apriltag_detection_t, c);
+    offsets[7] = offsetof(apriltag_detection_t, p);
+    *size = sizeof(apriltag_detection_t);
+}
@@ -291,9 +291,15 @@ void apriltag_detector_enable_quad_contours(apriltag_detector_t* td,
                                             int enable);
 
 // add a family to the apriltag detector. caller still "owns" the family.
-// a single instance should only be provided to one apriltag detector instance.
+// a single instance may be shared by several detectors; its decode
+// table is built on first use and freed by apriltag_family_destroy
+// (or the matching tagXXX_destroy).
 void apriltag_detector_add_family(apriltag_detector_t *td, apriltag_family_t *fam);
 
+// free the decode table attached to fam, if any. the family destroy
+// functions call this; only needed directly for hand-built families.
+void quick_decode_uninit(apriltag_family_t *fam);
+
 // does not deallocate the family.
 void apriltag_detector_remove_family(apriltag_detector_t *td, apriltag_family_t *fam);
 
@@ -316,6 +322,12 @@ void apriltag_detection_destroy(apriltag_detection_t *det);
 // destroys the array AND the detections within it.
 void apriltag_detections_destroy(zarray_t *detections);
 
+// Reports the memory layout of apriltag_detection_t for bindings that
+// read detections directly. offsets must hold 8 ints and receives the
+// offsets of family, id, hamming, goodness, decision_margin, H, c and
+// p, in that order; size receives sizeof(apriltag_detection_t).
+void apriltag_detection_layout(int *offsets, int *size);
+
 #ifdef __cplusplus
 }
 #endif
@@ -58,6 +58,7 @@ apriltag_family_t* apriltag_family_create(const char* famname) {
 
 void apriltag_family_destroy(apriltag_family_t *tf) {
   
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
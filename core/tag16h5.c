@@ -79,6 +79,7 @@ apriltag_family_t *tag16h5_create()
 
 void tag16h5_destroy(apriltag_family_t *tf)
 {
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
@@ -291,6 +291,7 @@ apriltag_family_t *tag25h7_create()
 
 void tag25h7_destroy(apriltag_family_t *tf)
 {
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
@@ -84,6 +84,7 @@ apriltag_family_t *tag25h9_create()
 
 void tag25h9_destroy(apriltag_family_t *tf)
 {
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
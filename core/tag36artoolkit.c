@@ -562,6 +562,7 @@ apriltag_family_t *tag36artoolkit_create()
 
 void tag36artoolkit_destroy(apriltag_family_t *tf)
 {
+    quick_decode_uninit(tf);
     free(tf->name);
     free(tf->codes);
     free(tf);
@@ -2369,6 +2369,7 @@ apriltag_family_t *tag36h10_create()
 
 void tag36h10_destroy(apriltag_family_t *tf)
 {
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
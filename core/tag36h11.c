@@ -636,6 +636,7 @@ apriltag_family_t *tag36h11_create()
 
 void tag36h11_destroy(apriltag_family_t *tf)
 {
+   quick_decode_uninit(tf);
    free(tf->name);
    free(tf->codes);
    free(tf);
@@ -12,10 +12,16 @@ Modifications; Sandeep Chahal
 
 """
 
+from __future__ import print_function
+
+import atexit
 import ctypes
 import collections
 import os
 import re
+import resource
+import threading
+import warnings
 import numpy
 
 ######################################################################
@@ -87,10 +93,70 @@ class _ApriltagDetector(ctypes.Structure):
 
 ######################################################################
 
+# how many differently-sized C scratch images a Detector keeps around
+_IMG_CACHE_SIZE = 4
+
+# row alignment used by image_u8_create (DEFAULT_ALIGNMENT in image_u8.c)
+_IMAGE_U8_ALIGNMENT = 96
+
+def _aligned_stride(width):
+    return -(-width // _IMAGE_U8_ALIGNMENT) * _IMAGE_U8_ALIGNMENT
+
+# the C detector spreads quad decoding over a worker pool; default to
+# one worker per core
+try:
+    _DEFAULT_NTHREADS = os.cpu_count() or 4
+except AttributeError: # Python 2
+    _DEFAULT_NTHREADS = 4
+
+# numpy mirror of _ApriltagDetection, so a batch of detections can be
+# read into one record array and sliced field-wise; pointers are kept
+# as raw addresses. Field order matches apriltag_detection_layout.
+_DETECTION_FIELDS = [
+    ('family', numpy.uintp),
+    ('id', numpy.intc),
+    ('hamming', numpy.intc),
+    ('goodness', numpy.float32),
+    ('decision_margin', numpy.float32),
+    ('H', numpy.uintp),
+    ('c', (numpy.float64, (2,))),
+    ('p', (numpy.float64, (4, 2))),
+]
+
+def _detection_dtype(offsets, itemsize):
+    return numpy.dtype({
+        'names': [name for name, _ in _DETECTION_FIELDS],
+        'formats': [fmt for _, fmt in _DETECTION_FIELDS],
+        'offsets': offsets,
+        'itemsize': itemsize})
+
+# layout assumed when the library cannot report its own
+_DETECTION_DTYPE = _detection_dtype(
+    [getattr(_ApriltagDetection, name).offset for name, _ in _DETECTION_FIELDS],
+    ctypes.sizeof(_ApriltagDetection))
+
+# apriltag homographies are always 3x3 doubles, so they are read as a
+# fixed 72-byte block rather than through matd's nrows/ncols
+_HOMOGRAPHY_BYTES = 9*ctypes.sizeof(ctypes.c_double)
+
+######################################################################
+
 def _ptr_to_array2d(datatype, ptr, rows, cols):
-    array_type = (datatype*cols)*rows
-    array_buf = array_type.from_address(ctypes.addressof(ptr))
-    return numpy.ctypeslib.as_array(array_buf, shape=(rows, cols))
+    nbytes = rows*cols*ctypes.sizeof(datatype)
+    array_buf = (ctypes.c_ubyte*nbytes).from_address(ctypes.addressof(ptr))
+    return numpy.frombuffer(array_buf, dtype=datatype).reshape(rows, cols)
+
+def _image_u8_from_array(img):
+
+    '''Return a pointer to an image_u8 whose buffer aliases the rows of
+img, which must be unit-stride uint8. The caller keeps img alive.'''
+
+    c_img = ctypes.pointer(_ImageU8())
+    c_img.contents.width = img.shape[1]
+    c_img.contents.height = img.shape[0]
+    c_img.contents.stride = img.strides[0]
+    c_img.contents.buf = img.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+    return c_img
 
 def _image_u8_get_array(img_ptr):
     return _ptr_to_array2d(ctypes.c_uint8,
@@ -98,11 +164,116 @@ def _image_u8_get_array(img_ptr):
                            img_ptr.contents.height,
                            img_ptr.contents.stride)
 
-def _matd_get_array(mat_ptr):
-    return _ptr_to_array2d(ctypes.c_double,
-                           mat_ptr.contents.data,
-                           int(mat_ptr.contents.nrows),
-                           int(mat_ptr.contents.ncols))
+# one CDLL object per loaded library, keyed by its dlopen handle, so
+# the function prototypes are declared once and shared by all Detectors
+_libraries = {}
+
+def _declare_return_types(libc):
+
+    libc.apriltag_detector_create.restype = ctypes.POINTER(_ApriltagDetector)
+    libc.apriltag_family_create.restype = ctypes.POINTER(_ApriltagFamily)
+    libc.apriltag_detector_detect.restype = ctypes.POINTER(_ZArray)
+    libc.image_u8_create.restype = ctypes.POINTER(_ImageU8)
+    libc.image_u8_write_pnm.restype = ctypes.c_int
+    libc.apriltag_family_list.restype = ctypes.POINTER(_ZArray)
+    libc.apriltag_vis_detections.restype = None
+
+    # argument types let ctypes convert arguments with precomputed
+    # converters instead of inspecting each Python object per call
+    detector_ptr = ctypes.POINTER(_ApriltagDetector)
+    family_ptr = ctypes.POINTER(_ApriltagFamily)
+    zarray_ptr = ctypes.POINTER(_ZArray)
+    image_ptr = ctypes.POINTER(_ImageU8)
+
+    libc.apriltag_detector_create.argtypes = []
+    libc.apriltag_detector_destroy.argtypes = [detector_ptr]
+    libc.apriltag_detector_enable_quad_contours.argtypes = [detector_ptr, ctypes.c_int]
+    libc.apriltag_detector_add_family.argtypes = [detector_ptr, family_ptr]
+    libc.apriltag_detector_detect.argtypes = [detector_ptr, image_ptr]
+    libc.apriltag_detections_destroy.argtypes = [zarray_ptr]
+    libc.apriltag_family_create.argtypes = [ctypes.c_char_p]
+    libc.apriltag_family_destroy.argtypes = [family_ptr]
+    libc.apriltag_family_list.argtypes = []
+    libc.apriltag_family_list_destroy.argtypes = [zarray_ptr]
+    libc.apriltag_vis_detections.argtypes = [zarray_ptr, image_ptr]
+    libc.image_u8_create.argtypes = [ctypes.c_uint, ctypes.c_uint]
+    libc.image_u8_destroy.argtypes = [image_ptr]
+
+def _shared_library(libc):
+
+    '''Return the CDLL already registered for the library libc refers
+to, declaring its function prototypes the first time it is seen.'''
+
+    shared = _libraries.get(libc._handle)
+
+    if shared is None:
+        _declare_return_types(libc)
+        shared = _libraries[libc._handle] = libc
+
+    return shared
+
+def _library_detection_dtype(libc):
+
+    '''Build the detection dtype from the layout libc reports, falling
+back to _DETECTION_DTYPE for libraries without
+apriltag_detection_layout.'''
+
+    try:
+        layout = libc.apriltag_detection_layout
+    except AttributeError:
+        return _DETECTION_DTYPE
+
+    # optional symbol, so it is declared here rather than alongside the
+    # rest in _declare_return_types
+    layout.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+    layout.restype = None
+
+    offsets = (ctypes.c_int*len(_DETECTION_FIELDS))()
+    size = ctypes.c_int()
+    layout(offsets, ctypes.byref(size))
+
+    return _detection_dtype(list(offsets), size.value)
+
+def _read_detections(zarr_ptr, dtype):
+
+    '''Copy every apriltag_detection in a zarray of detection pointers
+into a numpy record array of the given dtype, and the homographies
+they point at into an (N, 3, 3) array.
+
+apriltag_detector_detect returns a zarray of apriltag_detection_t*,
+not of structs, so the detections themselves are scattered on the C
+heap and each is copied separately.'''
+
+    zarr = zarr_ptr.contents
+    size = zarr.size
+
+    assert zarr.el_sz == ctypes.sizeof(ctypes.c_void_p)
+
+    if size == 0:
+        return (numpy.empty(0, dtype=dtype),
+                numpy.empty((0, 3, 3)))
+
+    # bind lookups to locals once; the loops below run per tag
+    memmove = ctypes.memmove
+    itemsize = dtype.itemsize
+    data_offset = _Matd.data.offset
+
+    # memmove straight into preallocated arrays, so there is no
+    # intermediate bytes object or view per tag
+    ptrs = (ctypes.c_void_p*size).from_address(zarr.data)
+    tags = numpy.empty(size, dtype=dtype)
+    dst = tags.ctypes.data
+    for ptr in ptrs:
+        memmove(dst, ptr, itemsize)
+        dst += itemsize
+
+    homographies = numpy.empty((size, 3, 3))
+    dst = homographies.ctypes.data
+    for ptr in tags['H'].tolist():
+        memmove(dst, ptr+data_offset, _HOMOGRAPHY_BYTES)
+        dst += _HOMOGRAPHY_BYTES
+
+    return tags, homographies
 
 ######################################################################
 
@@ -129,20 +300,19 @@ tuple class.
 
         '''Converts this object to a string with the given level of indentation.'''
 
+        width = self._max_len+indent
+        newline_indent = '\n' + ' '*(width+2)
+
         rval = []
-        indent_str = ' '*(self._max_len+2+indent)
 
-        for i, label in enumerate(self._print_fields):
+        for label, value in zip(self._print_fields, self):
 
-            value = str(self[i])
+            value = str(value)
 
-            if value.find('\n') > 0:
-                value = value.split('\n')
-                value = [value[0]] + [indent_str+v for v in value[1:]]
-                value = '\n'.join(value)
+            if '\n' in value:
+                value = newline_indent.join(value.split('\n'))
 
-            rval.append('{:>{}s}: {}'.format(
-                label, self._max_len+indent, value))
+            rval.append('{:>{}s}: {}'.format(label, width, value))
 
         return '\n'.join(rval)
 
@@ -151,6 +321,13 @@ tuple class.
 
 ######################################################################
 
+DetectionBatch = collections.namedtuple(
+    'DetectionBatch',
+    'tag_families, tag_ids, hamming, goodness, decision_margin, '
+    'homographies, centers, corners')
+
+######################################################################
+
 
 class DetectorOptions(object):
 
@@ -158,6 +335,13 @@ class DetectorOptions(object):
 initializer. You can also pass in the output of an
 argparse.ArgumentParser on which you have called add_arguments.
 
+nthreads defaults to the number of CPUs. quad_decimate=2.0 runs quad
+detection on an image of half the width and height (a quarter of the
+pixels), which is the usual choice for real-time video; use 1.0 for
+very small or distant tags. use_cuda=True loads the GPU build
+(libapriltag_cuda) when it is installed, falling back to the CPU
+library otherwise.
+
     '''
 
 # pylint: disable=R0902
@@ -166,14 +350,15 @@ argparse.ArgumentParser on which you have called add_arguments.
     def __init__(self,
                  families='tag36h11',
                  border=1,
-                 nthreads=4,
-                 quad_decimate=1.0,
+                 nthreads=_DEFAULT_NTHREADS,
+                 quad_decimate=2.0,
                  quad_blur=0.0,
                  refine_edges=True,
                  refine_decode=False,
                  refine_pose=False,
                  debug=False,
-                 quad_contours=True):
+                 quad_contours=True,
+                 use_cuda=False):
 
         self.families = families
         self.border = int(border)
@@ -186,6 +371,7 @@ argparse.ArgumentParser on which you have called add_arguments.
         self.refine_pose = int(refine_pose)
         self.debug = int(debug)
         self.quad_contours = quad_contours
+        self.use_cuda = bool(use_cuda)
 
 
 ######################################################################
@@ -196,13 +382,23 @@ class Detector(object):
 the output of an argparse.ArgumentParser on which you have called
 add_arguments; or an instance of the DetectorOptions class.'''
 
+    # tag families may be shared between detectors: the C detector only
+    # adds a decode table (fam->impl) the first time a family is added,
+    # and reads it from then on. So each family is built once per
+    # process and library; see _destroy_cached_families
+    _family_ptr_cache = {}
+    _family_ptr_lock = threading.RLock()
+
     def __init__(self, options=None):
 
         if options is None:
             options = DetectorOptions()
 
         self.options = options
-
+        self._pinned_img = None
+        self._img_cache = collections.OrderedDict()
+        self._family_name_cache = {}
+        self._executor = None
 
         # detect OS to get extension for DLL
         uname0 = os.uname()[0]
@@ -214,48 +410,60 @@ add_arguments; or an instance of the DetectorOptions class.'''
         filename = 'libapriltag'+extension
 
 
-        # load the C library and store it as a class variable
-        # note: prefer OS install to local!
-        try:
-            self.libc = ctypes.CDLL(filename)
-        except OSError:
-            selfdir = os.path.dirname(__file__)
-            #relpath = os.path.join(selfdir, '../build/lib/', filename)
-            relpath = os.path.join(selfdir, filename)
-            if not os.path.exists(relpath):
-                """new edit starts"""
-                # raise
-                relpath = os.path.join(os.getcwd(), '../build/lib', filename)
+        self.libc = None
+
+        # the apriltags_cuda build exports the same C API, so it can be
+        # dropped in place of the CPU library when present
+        if getattr(options, 'use_cuda', False):
+            try:
+                self.libc = ctypes.CDLL('libapriltag_cuda'+extension)
+            except OSError:
+                warnings.warn('libapriltag_cuda not found, using CPU detector',
+                              stacklevel=2)
+
+        if self.libc is None:
 
+            # load the C library and store it as a class variable
+            # note: prefer OS install to local!
+            try:
+                self.libc = ctypes.CDLL(filename)
+            except OSError:
+                selfdir = os.path.dirname(__file__)
+                #relpath = os.path.join(selfdir, '../build/lib/', filename)
+                relpath = os.path.join(selfdir, filename)
                 if not os.path.exists(relpath):
-                    raise
-                """new edit ends"""
-            self.libc = ctypes.CDLL(relpath)
-            
-        # declare return types of libc function
-        self._declare_return_types()
+                    relpath = os.path.join(os.getcwd(), '../build/lib', filename)
+
+                    if not os.path.exists(relpath):
+                        raise
+                self.libc = ctypes.CDLL(relpath)
+
+        # declare return types of libc function; ctypes keeps those on
+        # the CDLL object, so reuse the one set up by earlier Detectors
+        self.libc = _shared_library(self.libc)
+
+        # forks of libapriltag do not all agree on the detection struct
+        self._detection_dtype = _library_detection_dtype(self.libc)
 
         # create the c-_apriltag_detector object
         self.tag_detector = self.libc.apriltag_detector_create()
         self.tag_detector.contents.nthreads = int(options.nthreads)
         self.tag_detector.contents.quad_decimate = float(options.quad_decimate)
         self.tag_detector.contents.quad_sigma = float(options.quad_sigma)
-        self.tag_detector.refine_edges = int(options.refine_edges)
-        self.tag_detector.refine_decode = int(options.refine_decode)
-        self.tag_detector.refine_pose = int(options.refine_pose)
+        self.tag_detector.contents.refine_edges = int(options.refine_edges)
+        self.tag_detector.contents.refine_decode = int(options.refine_decode)
+        self.tag_detector.contents.refine_pose = int(options.refine_pose)
 
         if options.quad_contours:
             self.libc.apriltag_detector_enable_quad_contours(self.tag_detector, 1)
 
-        self.families = []
-
         flist = self.libc.apriltag_family_list()
 
-        for i in range(flist.contents.size):
-            ptr = ctypes.c_char_p()
-            self.libc.zarray_get(flist, i, ctypes.byref(ptr))
-            self.families.append(ctypes.string_at(ptr))
-		
+        # the zarray holds a packed array of const char*, so read the
+        # names directly instead of one zarray_get per entry
+        names = (ctypes.c_char_p*flist.contents.size).from_address(flist.contents.data)
+        self.families = list(names)
+
         self.libc.apriltag_family_list_destroy(flist)  # sandeep's edit
 
         if options.families == 'all':
@@ -270,133 +478,238 @@ add_arguments; or an instance of the DetectorOptions class.'''
             self.add_tag_family(family)
 
     def __del__(self):  # sandeep edit
+        if self._executor is not None:
+            # pending work holds a reference to self, so nothing is queued
+            # by now; don't wait, as this may run on the worker itself
+            self._executor.shutdown(wait=False)
+        for c_img, _ in self._img_cache.values():
+            self.libc.image_u8_destroy(c_img)
+        self._img_cache.clear()
         self.libc.apriltag_detector_destroy(self.tag_detector)
 
     #@profile
-    def detect(self, img, return_image=False, bot_cam=False):
+    def detect(self, img, return_image=False, bot_cam=False, image_out=None):
 
         '''Run detectons on the provided image. The image must be a grayscale
-image of type numpy.uint8.'''
+image of type numpy.uint8.
 
-        assert len(img.shape) == 2
-        assert img.dtype == numpy.uint8
+With return_image, the detections are also drawn into an image that is
+returned alongside them. Pass a writeable uint8 array shaped like img
+as image_out to draw into it, on top of its current contents, instead
+of into a new zeroed array; image_out requires return_image.'''
 
-        c_img = self._convert_image(img)
+        rval = self.detect_batch(img, return_image, image_out)
+        batch = rval[0] if return_image else rval
+
+        if bot_cam:
 
-        return_info = []
-        #import resource # related to memoryleak
-        #detect apriltags in the image # related to memoryleak
-        #print "before", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # related to memoryleak
+            return_info = batch.tag_ids.tolist()
 
-        detections = self.libc.apriltag_detector_detect(self.tag_detector, c_img) #already in
+        else:
+
+            return_info = [
+                Detection(*fields) for fields in zip(
+                    batch.tag_families,
+                    batch.tag_ids.tolist(),
+                    batch.hamming.tolist(),
+                    batch.goodness.tolist(),
+                    batch.decision_margin.tolist(),
+                    batch.homographies,
+                    batch.centers,
+                    batch.corners)]
 
-        #print "after", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # related to memoryleak
+        if return_image:
+            return return_info, rval[1]
 
-        #create a pytags_info object
-        #return_info = [] #  commenting this line related to memoryleak
+        return return_info
 
-        apriltag = ctypes.POINTER(_ApriltagDetection)() # related to memoryleak
-        """new edit ends"""
+    def detect_async(self, img, return_image=False, bot_cam=False, image_out=None):
 
-        for i in range(0, detections.contents.size):
+        '''Start detect() on a background thread and return a
+concurrent.futures.Future for its result. The C detector runs without
+the GIL, so the caller can grab and prepare the next frame meanwhile.
 
-            #extract the data for each apriltag that was identified
-            # apriltag = ctypes.POINTER(_ApriltagDetection)() # commenting this line related to memoryleak
-            self.libc.zarray_get(detections, i, ctypes.byref(apriltag))
+Calls are processed one at a time, in order. img may be used in place
+by the detector, so leave it unmodified until the future is done, and
+do not call detect() on the same Detector while futures are pending.'''
 
-            tag = apriltag.contents
+        if self._executor is None:
+            # imported here so the module still loads on Python 2,
+            # where concurrent.futures needs the futures backport
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
-            homography = _matd_get_array(tag.H).copy()
-            center = numpy.ctypeslib.as_array(tag.c, shape=(2,)).copy()
-            corners = numpy.ctypeslib.as_array(tag.p, shape=(4, 2)).copy()
+        return self._executor.submit(self.detect, img, return_image, bot_cam,
+                                     image_out)
 
-            if bot_cam:
+    def detect_batch(self, img, return_image=False, image_out=None):
 
-                return_info.append(tag.id)
+        '''Like detect(), but return a single DetectionBatch holding one
+array per field (e.g. centers of shape (N, 2)) instead of a list of
+N Detection objects.'''
 
-            else:
-                detection = Detection(
-                    ctypes.string_at(tag.family.contents.name),
-                    tag.id,
-                    tag.hamming,
-                    tag.goodness,
-                    tag.decision_margin,
-                    homography,
-                    center,
-                    corners) # tag.family.contents.name, #sandeeps edit
-
-                #Append this dict to the tag data array
-                return_info.append(detection)
-        #"""new edit starts"""
-        # self.libc.image_u8_destroy(c_img) # doesn't work
-        c_img = None # related to memory leak
-        #"""new edit ends"""
+        assert len(img.shape) == 2
+        assert img.dtype == numpy.uint8
+
+        if image_out is not None:
+            assert return_image
+            assert image_out.shape == img.shape
+            assert image_out.dtype == numpy.uint8
+            assert image_out.strides[1] == 1
+            assert image_out.flags.writeable
+
+        c_img = self._convert_image(img)
+
+        if self.options.debug:
+            print('before', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+        detections = self.libc.apriltag_detector_detect(self.tag_detector, c_img)
+
+        if self.options.debug:
+            print('after', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+        tags, homographies = _read_detections(detections, self._detection_dtype)
+
+        # a scene only ever references the few families we added, so
+        # look each name up once per family pointer
+        names = []
+        cache = self._family_name_cache
+        for fam in tags['family'].tolist():
+            name = cache.get(fam)
+            if name is None:
+                name = ctypes.cast(fam, ctypes.POINTER(_ApriltagFamily)).contents.name
+                cache[fam] = name
+            names.append(name)
+
+        batch = DetectionBatch(
+            names,
+            tags['id'].astype(numpy.int32),
+            tags['hamming'].astype(numpy.int32),
+            tags['goodness'].copy(),
+            tags['decision_margin'].copy(),
+            homographies,
+            tags['c'].copy(),
+            tags['p'].copy())
+
+        # an aliased numpy buffer is released by dropping the pin;
+        # anything else is a cached scratch image and stays alive.
+        self._pinned_img = None
+        c_img = None
         if return_image:
 
-            dimg = self._vis_detections(img.shape, detections)
-            rval = return_info, dimg
+            dimg = self._vis_detections(img.shape, detections, image_out)
+            rval = batch, dimg
 
         else:
 
-            rval = return_info
+            rval = batch
 
         self.libc.apriltag_detections_destroy(detections)
         return rval
 
-
     def add_tag_family(self, name):
 
-        '''Add a single tag family to this detector.'''
+        '''Add a single tag family to this detector. The family object
+is shared with every other Detector using it, so per-family settings
+such as the border width are those of the family definition, not of
+this detector's options.'''
 
-        family = self.libc.apriltag_family_create(name)
+        if not isinstance(name, bytes):
+            name = name.encode('ascii')
 
-        if family:
-            family.contents.border = self.options.border
-            self.libc.apriltag_detector_add_family(self.tag_detector, family)
-        else:
-            print 'Unrecognized tag family name. Try e.g. tag36h11'
+        key = (self.libc._handle, name)
 
-    def _vis_detections(self, shape, detections):
+        # the first add_family builds the shared decode table in
+        # fam->impl, so it must not race with another Detector's
+        with Detector._family_ptr_lock:
+            cached = Detector._family_ptr_cache.get(key)
+            if cached is None:
+                family = self.libc.apriltag_family_create(name)
+                if family:
+                    Detector._family_ptr_cache[key] = (self.libc, family)
+            else:
+                family = cached[1]
 
-        height, width = shape
-        c_dimg = self.libc.image_u8_create(width, height)
-        self.libc.apriltag_vis_detections(detections, c_dimg)
-        tmp = _image_u8_get_array(c_dimg)
-        """new edit starts"""
+            if family:
+                self.libc.apriltag_detector_add_family(self.tag_detector, family)
 
-        rval = tmp[:, :width].copy()
+        if not family:
+            print('Unrecognized tag family name. Try e.g. tag36h11')
 
-        self.libc.image_u8_destroy(c_dimg)
+    def _vis_detections(self, shape, detections, dimg=None):
 
-        #return tmp[:, :width].copy()
-        return rval
-    """new edit ends"""
+        # draw straight into the array we hand back, so there is no
+        # stride-padded C image to crop and copy out of
+        if dimg is None:
+            dimg = numpy.zeros(shape, dtype=numpy.uint8)
+
+        self.libc.apriltag_vis_detections(detections, _image_u8_from_array(dimg))
+
+        return dimg
+
+    def _scratch_image(self, width, height):
+
+        '''Return a (c_img, array) pair for a width x height image_u8,
+reusing an earlier allocation of the same size from self._img_cache
+when there is one. The least recently used size is evicted when the
+cache is full.'''
+
+        cache = self._img_cache
+        key = (height, width)
+        entry = cache.pop(key, None)
 
-    def _declare_return_types(self):
+        if entry is None:
+            if len(cache) >= _IMG_CACHE_SIZE:
+                old_img, _ = cache.popitem(last=False)[1]
+                self.libc.image_u8_destroy(old_img)
+            c_img = self.libc.image_u8_create(width, height)
+            entry = (c_img, _image_u8_get_array(c_img))
 
-        self.libc.apriltag_detector_create.restype = ctypes.POINTER(_ApriltagDetector)
-        self.libc.apriltag_family_create.restype = ctypes.POINTER(_ApriltagFamily)
-        self.libc.apriltag_detector_detect.restype = ctypes.POINTER(_ZArray)
-        self.libc.image_u8_create.restype = ctypes.POINTER(_ImageU8)
-        self.libc.image_u8_write_pnm.restype = ctypes.c_int
-        self.libc.apriltag_family_list.restype = ctypes.POINTER(_ZArray)
-        self.libc.apriltag_vis_detections.restype = None
+        # (re)insert at the end, which marks key as most recently used;
+        # move_to_end would do the same but is missing on Python 2
+        cache[key] = entry
+
+        return entry
 
     def _convert_image(self, img):
 
         height = img.shape[0]
         width = img.shape[1]
-        c_img = self.libc.image_u8_create(width, height)
 
-        tmp = _image_u8_get_array(c_img)
+        # fast path: point the C struct straight at the numpy buffer
+        # instead of copying. The array is pinned on self until detection
+        # finishes. Without decimation the detector runs quad detection
+        # on its input directly, so aliasing is only safe when it will
+        # not blur/sharpen it in place (quad_sigma == 0) and, for the
+        # threshold-based quad detector, when the rows already have the
+        # aligned stride image_u8_create would give them.
+        td = self.tag_detector.contents
+        aligned = img.strides[0] == _aligned_stride(width)
+        can_alias = (td.quad_decimate > 1 or
+                     (td.quad_sigma == 0 and (td.quad_contours or aligned)))
+
+        if can_alias and img.strides[1] == 1 and img.strides[0] >= width:
+            self._pinned_img = img
+            return _image_u8_from_array(img)
+
+        c_img, tmp = self._scratch_image(width, height)
 
         # copy the opencv image into the destination array, accounting for the
         # difference between stride & width.
         tmp[:, :width] = img
 
-        # tmp goes out of scope here but we don't care because
-        # the underlying data is still in c_img.
+        self._pinned_img = None
         return c_img
 
 ######################################################################
 
+def _destroy_cached_families():
+
+    '''Free the tag families shared by all detectors at interpreter exit.'''
+
+    with Detector._family_ptr_lock:
+        for libc, family in Detector._family_ptr_cache.values():
+            libc.apriltag_family_destroy(family)
+        Detector._family_ptr_cache.clear()
+
+atexit.register(_destroy_cached_families)